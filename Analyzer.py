@@ -2,6 +2,10 @@ import ast
 import json
 import sys
 
+# Node types that can hold statements: statements themselves plus the
+# except/case clauses of try and match
+STATEMENT_CONTAINERS = (ast.stmt, ast.excepthandler, ast.match_case)
+
 class ERPNextAnalyzer(ast.NodeVisitor):
     def __init__(self):
         self.stats = {
@@ -9,19 +13,42 @@ class ERPNextAnalyzer(ast.NodeVisitor):
             "business_rules": [],
             "dependencies": set()
         }
-        self.current_function = None
+
+        # Handlers keyed by exact node type, so finding one is a single dict
+        # lookup instead of NodeVisitor's "visit_" + class name getattr
+        self._dispatch = {
+            ast.FunctionDef: self.visit_FunctionDef,
+            ast.ImportFrom: self.visit_ImportFrom,
+        }
+
+    def visit(self, tree):
+        """
+        Walk the tree iteratively, calling a handler for each node that
+        has one. Handlers don't need to visit their children.
+
+        Only statements are walked. Everything we handle is a statement,
+        and statements only ever sit in other statements' bodies (or in
+        except/case clauses), never inside expressions, so expression
+        subtrees - the bulk of every function body - are skipped whole.
+        """
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            handler = self._dispatch.get(type(node))
+            if handler is not None:
+                handler(node)
+            # Reversed so children come off the stack in source order
+            stack.extend(reversed([
+                child for child in ast.iter_child_nodes(node)
+                if isinstance(child, STATEMENT_CONTAINERS)
+            ]))
 
     def visit_FunctionDef(self, node):
         self.stats["methods_found"] += 1
-        self.current_function = node.name
         
         # specific logic to analyze the crucial 'on_submit' method
         if node.name == 'on_submit':
             self.analyze_on_submit(node)
-        
-        # Continue visiting child nodes
-        self.generic_visit(node)
-        self.current_function = None
 
     def analyze_on_submit(self, node):
         """
@@ -47,7 +74,6 @@ class ERPNextAnalyzer(ast.NodeVisitor):
         """
         if node.module:
             self.stats["dependencies"].add(node.module)
-        self.generic_visit(node)
 
 def analyze_file(filename):
     with open(filename, "r", encoding="utf-8") as f:
@@ -1,89 +1,458 @@
-import json
 import ast
+import asyncio
+import hashlib
+import importlib.util
+import math
+import mmap
+import os
+import pickle
+import signal
+from functools import lru_cache
 from pathlib import Path
 
 import faiss
 import numpy as np
+import orjson
+import torch
 from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+from openai import AsyncOpenAI
+from tqdm import trange
 
 ENTITIES_FILE = Path("output/erpnext_entities.json")
 INDEX_FILE = Path("output/erpnext.index")
 META_FILE = Path("output/metadata.json")
+# Document texts, one JSON string per line, plus the byte offset of each
+# line so a single text can be read without loading the rest
+TEXTS_FILE = Path("output/texts.ndjson")
+TEXT_OFFSETS_FILE = Path("output/texts.offsets.npy")
+# Token ids of every document text, keyed by a hash of the text
+TOKEN_CACHE_FILE = Path("output/.token_cache.pkl")
+# Share of texts that must come from the token cache for build_index to
+# encode them itself rather than through the multi-process pool
+TOKEN_CACHE_MIN_REUSE = 0.5
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
-client = OpenAI()
+MODEL_NAME = "all-MiniLM-L6-v2"
+# int8 dynamically-quantized ONNX export published alongside the model
+ONNX_MODEL_FILE = "onnx/model_quint8_avx2.onnx"
+
+# Below this size an HNSW graph beats IVF: no training step and no
+# centroid scan per query. A single ERPNext checkout is ~10-50k chunks.
+HNSW_MAX_VECTORS = 200_000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+PQ_SUBQUANTIZERS = 32  # 384-d MiniLM vectors -> 32 sub-vectors of 12 dims
+NPROBE = 16
+# Learn an OPQ rotation ahead of PQ. Sentence embeddings have correlated
+# dimensions, which is what OPQ spreads evenly over the sub-quantizers;
+# training is ~3x slower, so switch it off if that matters more than recall.
+USE_OPQ = True
+
+ADD_BATCH_SIZE = 1024
+
+# Every pool worker re-imports this script and holds its own model copy
+MAX_CPU_ENCODE_WORKERS = 8
+
+def load_model():
+    # The quantized graph only has CPU kernels, so GPUs stay on torch, as
+    # does any install without optimum[onnxruntime]
+    if torch.cuda.is_available():
+        # fp16 halves the weights and activations moved per batch
+        return SentenceTransformer(MODEL_NAME, device="cuda").half().eval()
+    if not _has_onnx_backend():
+        return SentenceTransformer(MODEL_NAME).eval()
+
+    return SentenceTransformer(
+        MODEL_NAME, backend="onnx", model_kwargs={"file_name": ONNX_MODEL_FILE}
+    )
+
+def _has_onnx_backend():
+    # sentence-transformers needs both ONNX Runtime and optimum's ORT
+    # integration; optimum alone may be installed for another extra
+    # (intel, habana) and then backend="onnx" fails on load
+    if importlib.util.find_spec("onnxruntime") is None:
+        return False
+    if importlib.util.find_spec("optimum") is None:
+        return False
+    return importlib.util.find_spec("optimum.onnxruntime") is not None
+
+client = AsyncOpenAI()
+
+# Loaded on first use and kept for the rest of the session. The model is
+# lazy too: build_index's encoding pool spawns workers that re-import this
+# script, and they get the model pickled from here rather than each
+# loading (and thread-configuring) their own copy at import.
+_model = None
+_index = None
+_metadata = None
+_texts = None
+
+# Must outlive every index moved onto the GPU with it
+_gpu_resources = None
 
 def build_documents():
-    data = json.loads(ENTITIES_FILE.read_text(encoding="utf-8"))
-    documents = []
+    # Parallel lists: texts[i] is described by metadatas[i]
+    data = orjson.loads(ENTITIES_FILE.read_bytes())
+    texts = []
+    metadatas = []
 
     for file, entities in data.items():
         for ent in entities:
             if ent["type"] == "class":
-                documents.append({
-                    "text": ent["source_code"],
-                    "metadata": {
-                        "file": file,
-                        "name": ent["name"],
-                        "type": "class"
-                    }
+                texts.append(ent["source_code"])
+                metadatas.append({
+                    "file": file,
+                    "name": ent["name"],
+                    "type": "class"
                 })
                 for m in ent["methods"]:
-                    documents.append({
-                        "text": m["source_code"],
-                        "metadata": {
-                            "file": file,
-                            "class": ent["name"],
-                            "name": m["name"],
-                            "type": "method"
-                        }
+                    texts.append(m["source_code"])
+                    metadatas.append({
+                        "file": file,
+                        "class": ent["name"],
+                        "name": m["name"],
+                        "type": "method"
                     })
             else:
-                documents.append({
-                    "text": ent["source_code"],
-                    "metadata": {
-                        "file": file,
-                        "name": ent["name"],
-                        "type": "function"
-                    }
+                texts.append(ent["source_code"])
+                metadatas.append({
+                    "file": file,
+                    "name": ent["name"],
+                    "type": "function"
                 })
 
-    return documents
+    return texts, metadatas
 
 def build_index():
+    global _index, _metadata, _texts
+
     print("📦 Building documents...")
-    docs = build_documents()
+    texts, metadatas = build_documents()
+
+    # Encode shortest-first so each batch is padded to a similar length
+    # instead of to whichever huge class happens to share it
+    token_ids, reused = tokenize_cached(texts)
+    order = np.argsort([len(ids) for ids in token_ids], kind="stable")
 
-    texts = [d["text"] for d in docs]
-    embeddings = model.encode(texts, show_progress_bar=True)
-    embeddings = np.array(embeddings).astype("float32")
+    # Pool workers can only be handed texts and tokenize them again, so
+    # once most of the corpus is cached encode the ids in this process,
+    # where torch already spreads each forward pass over every core. Ids
+    # are cached even when the pool encodes, for the next rebuild to use.
+    devices = _encode_devices()
+    if devices and reused < TOKEN_CACHE_MIN_REUSE * len(texts):
+        embeddings = encode_multi_process(texts, order, devices)
+    else:
+        embeddings = encode_from_tokens(token_ids, order, batch_size=64)
 
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
+    cpu_index = create_index(*embeddings.shape)
+    index = _to_gpu(cpu_index)
+    index.train(embeddings)
+    # Adding in slices bounds the scratch space FAISS allocates per add()
+    # (codes, graph links) to one slice rather than the whole corpus
+    for start in range(0, len(embeddings), ADD_BATCH_SIZE):
+        index.add(embeddings[start:start + ADD_BATCH_SIZE])
+
+    # GPU indexes can't be serialized directly
+    if index is not cpu_index:
+        cpu_index = faiss.index_gpu_to_cpu(index)
 
     INDEX_FILE.parent.mkdir(exist_ok=True)
 
-    faiss.write_index(index, str(INDEX_FILE))
-    META_FILE.write_text(json.dumps(docs, indent=2))
+    faiss.write_index(cpu_index, str(INDEX_FILE))
+    META_FILE.write_bytes(orjson.dumps(metadatas, option=orjson.OPT_INDENT_2))
+    write_texts(texts)
+
+    # Anything loaded before this rebuild is stale now
+    _index = _metadata = _texts = None
 
     print("✅ Vector index built")
-    print(f"Chunks stored: {len(docs)}")
+    print(f"Chunks stored: {len(texts)}")
+
+def _text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def tokenize_cached(texts):
+    # Rebuilding the index after metadata-only changes shouldn't pay for
+    # WordPiece again: reuse the ids of every text seen on the last build.
+    # Ids are only valid for the tokenizer and truncation length that made
+    # them, so a cache written for any other model is dropped.
+    # Returns the ids plus how many texts were already cached.
+    model = _get_model()
+    header = (MODEL_NAME, model.max_seq_length)
+    try:
+        with TOKEN_CACHE_FILE.open("rb") as f:
+            cached_header, cache = pickle.load(f)
+    except Exception:
+        cached_header, cache = None, {}
+    stale = cached_header != header
+    if stale:
+        cache = {}
+
+    keys = [_text_key(text) for text in texts]
+    missing = {}
+    reused = 0
+    for key, text in zip(keys, texts):
+        if key in cache:
+            reused += 1
+        else:
+            missing[key] = text
+
+    if missing:
+        # Same preprocessing and truncation model.encode() applies
+        encoded = model.tokenizer(
+            [text.strip() for text in missing.values()],
+            padding=False,
+            truncation=True,
+            max_length=model.max_seq_length,
+        )["input_ids"]
+        for key, ids in zip(missing, encoded):
+            cache[key] = np.asarray(ids, dtype=np.int32)
+
+    # Only keep the current corpus so the cache doesn't grow forever
+    pruned = len(cache) != len(set(keys))
+    cache = {key: cache[key] for key in keys}
+    if missing or stale or pruned:
+        TOKEN_CACHE_FILE.parent.mkdir(exist_ok=True)
+        with TOKEN_CACHE_FILE.open("wb") as f:
+            pickle.dump((header, cache), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return [cache[key] for key in keys], reused
+
+def encode_from_tokens(token_ids, order=None, batch_size=64):
+    # model.encode() minus the tokenizer: pad each batch of cached ids and
+    # run just the transformer, pooling and normalization modules.
+    # Batches are taken in `order` but each row is written straight to its
+    # own position in one preallocated float32 matrix, so there's never a
+    # second (sorted or list-of-arrays) copy of the embeddings.
+    if order is None:
+        order = np.arange(len(token_ids))
+
+    model = _get_model()
+    pad_id = model.tokenizer.pad_token_id
+    with_token_types = "token_type_ids" in model.tokenizer.model_input_names
+    embeddings = np.empty(
+        (len(token_ids), model.get_sentence_embedding_dimension()), dtype=np.float32
+    )
+
+    for start in trange(0, len(token_ids), batch_size, desc="Batches"):
+        rows = order[start:start + batch_size]
+        batch = [token_ids[i] for i in rows]
+        width = max(len(ids) for ids in batch)
+
+        input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        for row, ids in enumerate(batch):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+
+        features = {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask),
+        }
+        if with_token_types:
+            features["token_type_ids"] = torch.zeros_like(features["input_ids"])
+        features = {name: value.to(model.device) for name, value in features.items()}
+
+        with torch.inference_mode():
+            out = model(features)["sentence_embedding"]
+            out = torch.nn.functional.normalize(out.float(), p=2, dim=1)
+        embeddings[rows] = out.cpu().numpy()
+
+    return embeddings
+
+def _encode_devices():
+    # Devices to shard encoding over with a multi-process pool, or None to
+    # encode in this process. ONNX Runtime sessions can't be pickled into
+    # pool workers, and ORT already spreads one session over every core.
+    model = _get_model()
+    if model.backend != "torch":
+        return None
+
+    if model.device.type == "cuda":
+        gpus = torch.cuda.device_count()
+        return [f"cuda:{i}" for i in range(gpus)] if gpus > 1 else None
+
+    cpus = min(_available_cpus(), MAX_CPU_ENCODE_WORKERS)
+    return ["cpu"] * cpus if cpus > 1 else None
+
+def encode_multi_process(texts, order, devices, chunk_size=5000):
+    # One model replica per device, each encoding its share of every chunk.
+    # Chunks are taken in `order` and scattered straight into place, like
+    # encode_from_tokens(), so only one N x d matrix is ever held.
+    model = _get_model()
+    embeddings = np.empty(
+        (len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32
+    )
+
+    # Starting the pool moves the model to the CPU and leaves it there;
+    # queries are still embedded in this process, on the original device
+    device = model.device
+
+    # Spawned workers read this as torch starts up: split the cores between
+    # the workers, rather than every worker starting a thread per core
+    omp_threads = os.environ.get("OMP_NUM_THREADS")
+    os.environ["OMP_NUM_THREADS"] = str(max(1, _available_cpus() // len(devices)))
+    try:
+        pool = model.start_multi_process_pool(target_devices=devices)
+    except BaseException:
+        model.to(device)
+        raise
+    finally:
+        if omp_threads is None:
+            del os.environ["OMP_NUM_THREADS"]
+        else:
+            os.environ["OMP_NUM_THREADS"] = omp_threads
+
+    try:
+        for start in trange(0, len(texts), chunk_size, desc="Chunks"):
+            rows = order[start:start + chunk_size]
+            # Deprecated in sentence-transformers 5 in favour of
+            # encode(pool=...), which 3.x and 4.x don't support
+            embeddings[rows] = model.encode_multi_process(
+                [texts[i] for i in rows], pool, batch_size=64, normalize_embeddings=True
+            )
+    finally:
+        model.stop_multi_process_pool(pool)
+        model.to(device)
+
+    return embeddings
+
+def write_texts(texts):
+    # orjson escapes newlines inside strings, so each text is exactly one line
+    lines = [orjson.dumps(text) for text in texts]
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum([len(line) + 1 for line in lines], out=offsets[1:])
+
+    TEXTS_FILE.write_bytes(b"\n".join(lines) + b"\n")
+    np.save(TEXT_OFFSETS_FILE, offsets)
+
+def create_index(n, d):
+    # Embeddings are unit length, so inner product == cosine similarity
+    if n < HNSW_MAX_VECTORS:
+        # Graph nodes hold 8-bit scalar-quantized vectors: 1 byte per dim
+        # instead of 4, so each distance computation reads a quarter of the memory
+        index = faiss.IndexHNSWSQ(
+            d, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+
+    # Inverted lists over PQ codes: each vector is stored in PQ_SUBQUANTIZERS
+    # bytes instead of 4*d, and a query only scans NPROBE of the nlist lists.
+    # An HNSW graph over the centroids avoids comparing each query against
+    # all nlist of them.
+    nlist = int(4 * math.sqrt(n))
+    factory = f"IVF{nlist}_HNSW32,PQ{PQ_SUBQUANTIZERS}"
+    if USE_OPQ:
+        # Rotate first to balance variance across the PQ sub-vectors
+        factory = f"OPQ{PQ_SUBQUANTIZERS}," + factory
+    return faiss.index_factory(d, factory, faiss.METRIC_INNER_PRODUCT)
+
+def _get_model():
+    global _model
+    if _model is None:
+        # One intra-op thread per core this process may actually run on,
+        # which under CPU affinity or cpuset limits is fewer than
+        # os.cpu_count(); keep inter-op small
+        torch.set_num_threads(_available_cpus())
+        torch.set_num_interop_threads(2)
+        _model = load_model()
+    return _model
+
+def _available_cpus():
+    # sched_getaffinity is Linux-only; elsewhere fall back to every core
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _to_gpu(index):
+    global _gpu_resources
+
+    # CPU-only faiss builds don't even have the GPU classes
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+
+    if _gpu_resources is None:
+        _gpu_resources = faiss.StandardGpuResources()
+    try:
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, index)
+    except RuntimeError:
+        # HNSW has no GPU implementation - keep searching it on the CPU
+        return index
+
+def _get_index():
+    global _index
+    if _index is None:
+        index = faiss.read_index(str(INDEX_FILE))
+
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.nprobe = NPROBE
+
+        # Tuned before the copy, which carries nprobe over to the GPU index
+        _index = _to_gpu(index)
+    return _index
+
+def _get_metadata():
+    global _metadata
+    if _metadata is None:
+        # Parsed once per session, by orjson straight from the mapped file
+        # without first decoding it into a str
+        with META_FILE.open("rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                memoryview(data) as view:
+            _metadata = orjson.loads(view)
+    return _metadata
+
+def _get_texts():
+    global _texts
+    if _texts is None:
+        with TEXTS_FILE.open("rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _texts = (data, np.load(TEXT_OFFSETS_FILE))
+    return _texts
+
+def _get_text(i):
+    # Only the retrieved texts are ever read: slice line i out of the
+    # mapped NDJSON file using the offsets written by write_texts()
+    data, offsets = _get_texts()
+    return orjson.loads(data[offsets[i]:offsets[i + 1]])
+
+def warm_up():
+    # Load everything retrieve() needs up front
+    _get_model()
+    _get_index()
+    _get_metadata()
+    _get_texts()
+
+@lru_cache(maxsize=1024)
+def _embed_query(query):
+    # Cached as bytes so callers can't mutate the shared result
+    with torch.inference_mode():
+        q_emb = _get_model().encode([query], normalize_embeddings=True)
+    return q_emb.astype("float32").tobytes()
 
 def retrieve(query, top_k=5):
-    index = faiss.read_index(str(INDEX_FILE))
-    metadata = json.loads(META_FILE.read_text())
+    index = _get_index()
+    metadata = _get_metadata()
 
-    q_emb = model.encode([query]).astype("float32")
+    q_emb = np.frombuffer(_embed_query(query), dtype=np.float32).reshape(1, -1)
     _, indices = index.search(q_emb, top_k)
 
     results = []
     for idx in indices[0]:
-        results.append(metadata[idx])
+        # IVF search pads with -1 when the probed lists hold fewer than top_k
+        if idx >= 0:
+            results.append({"text": _get_text(idx), "metadata": metadata[idx]})
     return results
 
-def ask(question):
-    docs = retrieve(question)
+async def stream_answer(question):
+    # FAISS and the model are blocking calls - keep them off the event loop
+    docs = await asyncio.to_thread(retrieve, question)
 
     context = "\n\n".join([d["text"] for d in docs])
 
@@ -100,26 +469,56 @@ Question:
 Answer clearly:
 """
 
-    response = client.chat.completions.create(
+    # Stream so the answer starts printing with the first token instead of
+    # after the whole completion
+    stream = await client.chat.completions.create(
         model="gpt-4.1-mini",
         messages=[{"role":"user","content":prompt}],
-        temperature=0
+        temperature=0,
+        stream=True
     )
 
-    return response.choices[0].message.content
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def ask(question):
+    return "".join([part async for part in stream_answer(question)])
+
+async def repl():
+    # asyncio.run() swaps in a SIGINT handler that only cancels this task,
+    # which a blocking input() never notices - put back the one that
+    # raises KeyboardInterrupt so the first Ctrl-C at the prompt exits
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    # Load the index and metadata while the user types the first question.
+    # One yield lets the task hand warm_up to the executor; input() stays
+    # on the main thread, where an executor thread stuck in it would hold
+    # up asyncio.run() on exit.
+    warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    await asyncio.sleep(0)
+
+    while True:
+        q = input("Ask ERPNext > ")
+        if q.lower() in ["exit", "quit"]:
+            break
+
+        await warm_up_task
+        print()
+        async for part in stream_answer(q):
+            print(part, end="", flush=True)
+        print("\n")
+
+    await warm_up_task
 
 
 if __name__ == "__main__":
 
-    # Step A — Build index if not exists
-    if not INDEX_FILE.exists():
+    # Step A — Build index if not exists (or predates the separate texts file)
+    if not (INDEX_FILE.exists() and TEXTS_FILE.exists()):
         build_index()
 
     print("\n🧠 ERPNext RAG Ready!")
     print("Type your questions about ERPNext code.\n")
 
-    while True:
-        q = input("Ask ERPNext > ")
-        if q.lower() in ["exit", "quit"]:
-            break
-        print("\n" + ask(q) + "\n")
\ No newline at end of file
+    asyncio.run(repl())
\ No newline at end of file